@@ -1,5 +1,9 @@
+import orjson
 import streamlit as st
 
+import sheet_manager
+from awarding_logic import dev_override
+from graph_logic import generate_award_graph
 from sheet_manager import get_balance, init_sheets, post_pr, register_user
 
 st.set_page_config(page_title="WeCoin MVP")
@@ -8,7 +12,9 @@ st.caption("A minimal Streamlit app for registering users, posting PRs, and chec
 
 init_sheets()
 
-menu = st.sidebar.selectbox("Menu", ["Register", "Post PR", "View Balance"])
+menu = st.sidebar.selectbox(
+    "Menu", ["Register", "Post PR", "View Balance", "View Graphs", "Dev Tools"]
+)
 user_id = st.text_input("Enter your user ID:").strip()
 
 if menu == "Register":
@@ -39,3 +45,31 @@ elif menu == "View Balance":
     else:
         balance = get_balance(user_id)
         st.write(f"User {user_id} has {balance} WeCoin")
+
+elif menu == "View Graphs":
+    mode = st.selectbox("Graph mode", ["global", "user", "pr", "ea"])
+    if st.button("Generate Graph"):
+        if mode == "user" and not user_id:
+            st.error("Please enter a user ID for a per-user graph.")
+        else:
+            png = generate_award_graph(
+                mode,
+                user_id if mode == "user" else None,
+                sheet_manager.LEDGER_VERSION,
+            )
+            st.image(png)
+
+elif menu == "Dev Tools":
+    secret_key = st.text_input("Dev key:", type="password")
+    raw_json = st.text_area("Override parameters (JSON):", "{}")
+    if st.button("Apply Overrides"):
+        try:
+            new_params = orjson.loads(raw_json)
+        except orjson.JSONDecodeError as exc:
+            st.error(f"Invalid JSON: {exc}")
+        else:
+            ok, message = dev_override(secret_key, new_params)
+            if ok:
+                st.success(message)
+            else:
+                st.error(message)
@@ -1,10 +1,17 @@
+import hmac
+import math
 import time
-from datetime import datetime
+import streamlit as st
 from sheet_manager import (
-    get_user_data, update_user_data,
-    append_ledger, get_simulation_data, update_simulation_data
+    ConflictError, get_user_data, update_user_data, append_ledger,
+    add_hour_awarding, get_simulation_data, update_simulation_data,
+    today_iso, user_lock
 )
 
+# Optimistic-concurrency retry settings for user-row writes
+MAX_WRITE_RETRIES = 3
+RETRY_BASE_DELAY = 0.05
+
 # Developer-tweakable config
 CONFIG = {
     "DAILY_USER_CAP": 10240,
@@ -16,14 +23,23 @@ CONFIG = {
     "DOUBLE_MULTIPLIER": 2.0,
     "HALVE_BASE": 1.0,
     "USE_HOUR_LOGIC": True,
-    "SECRET_DEV_KEY": "mysecret123"
 }
 
+# The dev key lives in st.secrets, not in the tweakable CONFIG dict, so an
+# override can never overwrite the key itself. Cached after first use.
+_DEV_KEY = None
+
+def _dev_key():
+    global _DEV_KEY
+    if _DEV_KEY is None:
+        _DEV_KEY = str(st.secrets["dev_key"])
+    return _DEV_KEY
+
 def dev_override(secret_key, new_params):
     """
     Developer override to modify up to 20 parameters in CONFIG, if key is correct.
     """
-    if secret_key != CONFIG["SECRET_DEV_KEY"]:
+    if not hmac.compare_digest(str(secret_key).encode(), _dev_key().encode()):
         return (False, "Invalid secret key")
     updated_keys = []
     for k, v in new_params.items():
@@ -34,7 +50,7 @@ def dev_override(secret_key, new_params):
 
 def maybe_reset_daily(user_dict):
     """Resets daily counters if the date changed."""
-    today_str = datetime.now().date().isoformat()
+    today_str = today_iso()
     if user_dict["last_daily_reset"] != today_str:
         user_dict["daily_earned"] = 0
         user_dict["daily_pr_count"] = 0
@@ -49,42 +65,69 @@ def register_user(user_id):
     return f"User '{user_id}' is ready."
 
 def post_pr(user_id):
-    user_dict = get_user_data(user_id)
-    maybe_reset_daily(user_dict)
+    with user_lock(user_id):
+        for attempt in range(MAX_WRITE_RETRIES):
+            user_dict = get_user_data(user_id)
+            maybe_reset_daily(user_dict)
 
-    if user_dict["daily_pr_count"] >= CONFIG["MAX_DAILY_PRS"]:
-        return f"Daily PR limit of {CONFIG['MAX_DAILY_PRS']} reached."
+            if user_dict["daily_pr_count"] >= CONFIG["MAX_DAILY_PRS"]:
+                return f"Daily PR limit of {CONFIG['MAX_DAILY_PRS']} reached."
 
-    final_award = compute_award(user_dict, CONFIG["PR_AWARD"])
-    user_dict["daily_pr_count"] += 1
+            final_award = compute_award(user_dict, CONFIG["PR_AWARD"])
+            user_dict["daily_pr_count"] += 1
 
-    update_user_data(user_dict)
-    append_ledger(user_id, "POST_PR", "N/A", final_award, "User posted PR")
+            try:
+                update_user_data(user_dict)
+            except ConflictError:
+                # Another session updated this user first; re-fetch and re-award.
+                time.sleep(RETRY_BASE_DELAY * (2 ** attempt))
+                continue
 
-    return f"PR posted. Awarded {final_award} WeCoin."
+            append_ledger(user_id, "POST_PR", "N/A", final_award, "User posted PR")
+            return f"PR posted. Awarded {final_award} WeCoin."
+
+    return "PR not posted: too many concurrent updates, please retry."
 
 def post_ea(user_id):
-    user_dict = get_user_data(user_id)
-    maybe_reset_daily(user_dict)
+    with user_lock(user_id):
+        for attempt in range(MAX_WRITE_RETRIES):
+            user_dict = get_user_data(user_id)
+            maybe_reset_daily(user_dict)
+
+            # We'll pick the first EA tier for demonstration, though a real system might track how many EAs used
+            base_award = CONFIG["EA_AWARD_TIERS"][0]
+            final_award = compute_award(user_dict, base_award)
 
-    # We'll pick the first EA tier for demonstration, though a real system might track how many EAs used
-    base_award = CONFIG["EA_AWARD_TIERS"][0]
-    final_award = compute_award(user_dict, base_award)
+            try:
+                update_user_data(user_dict)
+            except ConflictError:
+                time.sleep(RETRY_BASE_DELAY * (2 ** attempt))
+                continue
 
-    update_user_data(user_dict)
-    append_ledger(user_id, "POST_EA", "N/A", final_award, "User posted EA")
+            append_ledger(user_id, "POST_EA", "N/A", final_award, "User posted EA")
+            return f"EA posted. Awarded {final_award} WeCoin."
 
-    return f"EA posted. Awarded {final_award} WeCoin."
+    return "EA not posted: too many concurrent updates, please retry."
 
 def view_wallet(user_id):
-    user_dict = get_user_data(user_id)
-    maybe_reset_daily(user_dict)
-    update_user_data(user_dict)
-    return (
-        f"Balance={user_dict['balance']} | "
-        f"Daily Earned={user_dict['daily_earned']} | "
-        f"Total Ever={user_dict['total_earned_ever']}"
-    )
+    with user_lock(user_id):
+        for attempt in range(MAX_WRITE_RETRIES):
+            user_dict = get_user_data(user_id)
+            maybe_reset_daily(user_dict)
+
+            try:
+                update_user_data(user_dict)
+            except ConflictError:
+                time.sleep(RETRY_BASE_DELAY * (2 ** attempt))
+                continue
+
+            return (
+                f"Balance={user_dict['balance']} | "
+                f"Daily Earned={user_dict['daily_earned']} | "
+                f"Total Ever={user_dict['total_earned_ever']}"
+            )
+
+    return "Wallet unavailable: too many concurrent updates, please retry."
 
 def compute_award(user_dict, base_amount):
     """
@@ -93,30 +136,39 @@ def compute_award(user_dict, base_amount):
     if not CONFIG["USE_HOUR_LOGIC"]:
         return apply_daily_cap(user_dict, base_amount)
 
-    # Hour-based logic:
+    # Hour-based logic; config lookups hoisted out of the hot path.
+    hourly_cap = CONFIG["HOURLY_2PCT_CAP"]
+    bracket_step = CONFIG["OVERRUN_BRACKET_STEP"]
+    halve_base = CONFIG["HALVE_BASE"]
+    double_mult = CONFIG["DOUBLE_MULTIPLIER"]
+
     sim_data = get_simulation_data()
-    ratio = sim_data["hour_awarding_so_far"] / CONFIG["HOURLY_2PCT_CAP"]
+    ratio = sim_data["hour_awarding_so_far"] / hourly_cap
     if ratio >= 1.0:
-        # Overrun - halving brackets
-        bracket_count = int((ratio - 1.0) // CONFIG["OVERRUN_BRACKET_STEP"]) + 1
-        new_mult = CONFIG["HALVE_BASE"] / (2 ** bracket_count)
-        sim_data["current_multiplier"] = new_mult
+        # Overrun - halving brackets (power of two via bit shift)
+        bracket_count = math.floor((ratio - 1.0) / bracket_step) + 1
+        sim_data["current_multiplier"] = halve_base / float(1 << bracket_count)
     else:
         # Underrun - if awarding < half by half hour => double
         fraction_of_hour = get_fraction_of_hour(sim_data["hour_index"])
         if fraction_of_hour >= 0.5:
-            half_cap = 0.5 * CONFIG["HOURLY_2PCT_CAP"]
+            half_cap = 0.5 * hourly_cap
             if sim_data["hour_awarding_so_far"] < half_cap:
-                sim_data["current_multiplier"] = CONFIG["DOUBLE_MULTIPLIER"]
+                sim_data["current_multiplier"] = double_mult
             else:
-                sim_data["current_multiplier"] = CONFIG["HALVE_BASE"]
+                sim_data["current_multiplier"] = halve_base
 
     final = apply_daily_cap(user_dict, base_amount * sim_data["current_multiplier"])
-    sim_data["hour_awarding_so_far"] += final
+    # Apply the award as a delta: sim_data is a stale copy by now, and
+    # writing an absolute counter back would drop concurrent awards.
+    add_hour_awarding(final)
     update_simulation_data(sim_data)
     return final
 
 def apply_daily_cap(user_dict, amt):
+    # Awards are whole WeCoin; round once here so balances and daily
+    # totals accumulate as integers without floating-point drift.
+    amt = int(round(amt))
     if user_dict["daily_earned"] >= CONFIG["DAILY_USER_CAP"]:
         return 0
     allowable = CONFIG["DAILY_USER_CAP"] - user_dict["daily_earned"]
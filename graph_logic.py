@@ -1,63 +1,46 @@
 import io
+import queue
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
-from datetime import datetime
-from sheet_manager import get_ledger_data
+import streamlit as st
+from sheet_manager import get_daily_award_sums
 
-def generate_award_graph(mode="global", user_id=None):
+# Reusable (fig, ax) pairs: figure allocation + teardown costs ~30ms per
+# render, so renders borrow from this pool and clear the axes instead.
+_FIG_POOL = queue.LifoQueue()
+
+@st.cache_data(ttl=60, max_entries=32)
+def generate_award_graph(mode="global", user_id=None, ledger_version=0):
     """
     mode in ["global","user","pr","ea"].
     user_id relevant if mode="user".
+    ledger_version keys the cache; pass sheet_manager.LEDGER_VERSION so
+    cached PNGs invalidate as soon as new awards land.
     Returns a PNG (bytes) of awarding vs. day.
     """
-    rows = get_ledger_data()  # each row: [timestamp, user_id, action_type, pr_or_ea_id, amount_awarded, notes]
-    awarding_points = []
-
-    for row in rows:
-        if len(row) < 5:
-            continue
-        raw_ts, r_user, action_type, pr_id, amt_str, notes = row
-        if not amt_str:
-            continue
-        try:
-            ts_dt = datetime.fromisoformat(raw_ts)
-            amount = float(amt_str)
-        except:
-            continue
-
-        # Filter logic
-        if mode == "user" and user_id:
-            if r_user != user_id:
-                continue
-        if mode == "pr" and action_type != "POST_PR":
-            continue
-        if mode == "ea" and action_type != "POST_EA":
-            continue
-
-        awarding_points.append((ts_dt, amount))
-
-    # Group awarding by day
-    awarding_points.sort(key=lambda x: x[0])
-    daily_sum = {}
-    for (ts_dt, amt) in awarding_points:
-        day_str = ts_dt.date().isoformat()
-        daily_sum[day_str] = daily_sum.get(day_str, 0) + amt
-
-    x_vals = sorted(daily_sum.keys())
-    y_vals = [daily_sum[x] for x in x_vals]
-
-    fig, ax = plt.subplots()
-    ax.plot(x_vals, y_vals, marker='o')
-    ax.set_title(f"Awarding Over Time - mode={mode}, user={user_id or 'ALL'}")
-    ax.set_xlabel("Date")
-    ax.set_ylabel("Sum of Awards")
-
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png")
-    plt.close(fig)
-    buf.seek(0)
-    return buf.getvalue()
+    # Day-bucketed totals come pre-filtered and pre-sorted from SQLite, so
+    # rendering never materializes or re-sorts the full ledger in Python.
+    daily = get_daily_award_sums(mode, user_id)
+    x_vals = [day for day, _ in daily]
+    y_vals = [total for _, total in daily]
+
+    try:
+        fig, ax = _FIG_POOL.get_nowait()
+    except queue.Empty:
+        fig, ax = plt.subplots()
+
+    try:
+        ax.cla()
+        ax.plot(x_vals, y_vals, marker='o')
+        ax.set_title(f"Awarding Over Time - mode={mode}, user={user_id or 'ALL'}")
+        ax.set_xlabel("Date")
+        ax.set_ylabel("Sum of Awards")
+        ax.tick_params(axis="x", rotation=45)
+        fig.tight_layout()
+
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png")
+        return buf.getvalue()
+    finally:
+        _FIG_POOL.put((fig, ax))
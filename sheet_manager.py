@@ -1,80 +1,713 @@
-import json
+import atexit
+import functools
+import queue
+import sqlite3
+import threading
+import time
 from datetime import datetime
 
+import google.auth.transport.requests
 import gspread
+import orjson
+import requests
 import streamlit as st
-from oauth2client.service_account import ServiceAccountCredentials
+from google.oauth2.service_account import Credentials
 
 SCOPE = [
     "https://spreadsheets.google.com/feeds",
     "https://www.googleapis.com/auth/drive",
 ]
 SPREADSHEET_NAME = "wecledger"
-USERS_HEADERS = ["user_id", "balance"]
-LEDGER_HEADERS = ["timestamp", "user_id", "action", "amount"]
+DB_PATH = "wecoin.db"
+USERS_HEADERS = [
+    "user_id",
+    "balance",
+    "daily_earned",
+    "daily_pr_count",
+    "total_earned_ever",
+    "last_daily_reset",
+]
+LEDGER_HEADERS = ["timestamp", "user_id", "action", "pr_ea_id", "amount", "notes"]
 STARTING_BALANCE = 400000
 PR_AWARD = 10
 
+# Bumped on every ledger append; cached graph renders key on it so they
+# invalidate as soon as new awards land.
+LEDGER_VERSION = 0
+
+# Memoized clock strings: these formatters sit on the hot path of every
+# post_pr/post_ea/view_wallet, so refresh them at most once per period.
+# Ages are measured with time.monotonic(), which is cheaper than
+# time.time() on most platforms and immune to wall-clock jumps.
+_TODAY_CACHE = {"age": -3600.0, "val": ""}
+_NOW_CACHE = {"age": -3600.0, "val": ""}
+
+
+def today_iso():
+    """Today's date as YYYY-MM-DD, refreshed at most once per minute."""
+    now = time.monotonic()
+    if now - _TODAY_CACHE["age"] > 60:
+        _TODAY_CACHE["age"] = now
+        _TODAY_CACHE["val"] = datetime.now().date().isoformat()
+    return _TODAY_CACHE["val"]
+
+
+def _now_iso():
+    """Current timestamp at second resolution, cached within the second."""
+    now = time.monotonic()
+    if now - _NOW_CACHE["age"] >= 1.0:
+        _NOW_CACHE["age"] = now
+        _NOW_CACHE["val"] = datetime.now().isoformat(timespec="seconds")
+    return _NOW_CACHE["val"]
+
+USER_FIELDS = USERS_HEADERS
+
+
+class ConflictError(Exception):
+    """Raised when a user-row write loses an optimistic-concurrency race."""
+
+# SQLite is the authoritative store; Google Sheets is kept as a best-effort
+# mirror updated from a background thread so UI requests never block on the API.
+_db_conn = None
+_db_lock = threading.Lock()
+
+# Per-user locks: read-modify-write sections for the same user serialize
+# in-process (no wasted optimistic-concurrency retries) while different
+# users never block each other.
+_user_locks = {}
+_user_locks_guard = threading.Lock()
+
 
+def user_lock(user_id):
+    with _user_locks_guard:
+        return _user_locks.setdefault(str(user_id), threading.Lock())
+
+_mirror_queue = queue.Queue()
+_mirror_thread = None
+
+# Mirror writes are buffered and flushed in batches: ledger rows go out
+# through one append_rows call, and user-row updates are deduped by
+# user_id (last write wins within a window) and sent as one batchUpdate.
+MIRROR_FLUSH_INTERVAL = 2.0
+MIRROR_FLUSH_BATCH = 50
+_ledger_buffer = []
+_user_buffer = {}
+_mirror_buffer_lock = threading.Lock()
+_mirror_flush_event = threading.Event()
+_mirror_flusher_thread = None
+
+# Simulation counters live in process memory under _sim_lock; a daemon
+# thread syncs them to the database instead of writing per award.
+SIM_FLUSH_INTERVAL = 5.0
+_sim_state = None
+_sim_lock = threading.Lock()
+_sim_flusher_thread = None
+
+
+def _db():
+    """Open the local SQLite database (once), in WAL mode."""
+    global _db_conn
+    if _db_conn is None:
+        with _db_lock:
+            if _db_conn is None:
+                conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute(
+                    # Amounts are whole WeCoin (see apply_daily_cap), so the
+                    # money columns are INTEGER like ledger.amount.
+                    "CREATE TABLE IF NOT EXISTS users ("
+                    "user_id TEXT PRIMARY KEY, "
+                    "balance INTEGER NOT NULL, "
+                    "daily_earned INTEGER NOT NULL, "
+                    "daily_pr_count INTEGER NOT NULL, "
+                    "total_earned_ever INTEGER NOT NULL, "
+                    "last_daily_reset TEXT NOT NULL, "
+                    "version INTEGER NOT NULL DEFAULT 0)"
+                )
+                columns = [info[1] for info in conn.execute("PRAGMA table_info(users)")]
+                if "version" not in columns:
+                    conn.execute("ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS ledger ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    "ts TEXT NOT NULL, "
+                    "user_id TEXT NOT NULL, "
+                    "action TEXT NOT NULL, "
+                    "pr_ea_id TEXT, "
+                    "amount INTEGER NOT NULL, "
+                    "notes TEXT)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_ledger_user_ts ON ledger (user_id, ts)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_ledger_action ON ledger (action)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS simulation ("
+                    "id INTEGER PRIMARY KEY CHECK (id = 1), "
+                    "hour_index INTEGER NOT NULL, "
+                    "hour_awarding_so_far REAL NOT NULL, "
+                    "current_multiplier REAL NOT NULL)"
+                )
+                conn.execute(
+                    "INSERT OR IGNORE INTO simulation (id, hour_index, hour_awarding_so_far, current_multiplier) "
+                    "VALUES (1, 0, 0.0, 1.0)"
+                )
+                _db_conn = conn
+    return _db_conn
+
+
+@st.cache_resource
 def get_gspread_client():
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(
-        json.loads(st.secrets["gcp_credentials"]),
-        SCOPE,
+    """Build the authorized gspread client once per process.
+
+    Streamlit reruns the whole script on every widget interaction;
+    cache_resource keeps the OAuth handshake out of those reruns.
+    """
+    creds = Credentials.from_service_account_info(
+        orjson.loads(st.secrets["gcp_credentials"]),
+        scopes=SCOPE,
+    )
+    client = gspread.authorize(creds)
+    # Pool and reuse TLS connections: the handshake (~100ms RTT) would
+    # otherwise dominate each short Sheets API call.
+    client.session.mount(
+        "https://",
+        requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16),
     )
-    return gspread.authorize(creds)
+    threading.Thread(target=_token_refresher, args=(creds,), daemon=True).start()
+    return client
 
 
-def _get_or_create_worksheet(spreadsheet, title, headers):
-    try:
-        worksheet = spreadsheet.worksheet(title)
-    except gspread.WorksheetNotFound:
-        worksheet = spreadsheet.add_worksheet(title=title, rows=1000, cols=max(len(headers), 10))
+def _token_refresher(creds):
+    """Refresh the OAuth token shortly before expiry, off the request path.
+
+    Without this, the first API call after the ~1h expiry eats the
+    300-500ms refresh round-trip; failures here are harmless because the
+    next API call refreshes lazily as before.
+    """
+    while True:
+        expiry = getattr(creds, "expiry", None)
+        if expiry is None:
+            delay = 300.0
+        else:
+            delay = max(60.0, (expiry - datetime.utcnow()).total_seconds() - 300.0)
+        time.sleep(delay)
+        try:
+            creds.refresh(google.auth.transport.requests.Request())
+        except Exception:
+            pass
+
+
+@functools.lru_cache(maxsize=4096)
+def _user_range(row_num):
+    """A1 range for a user row; row numbers repeat heavily, so cache them."""
+    return f"Users!A{row_num}:F{row_num}"
+
+
+def _api_status(exc):
+    return getattr(getattr(exc, "response", None), "status_code", None)
+
+
+def _retry_api(call, statuses=(429, 500, 503), tries=5, base=0.5, cap=8.0):
+    """Run a Sheets call, absorbing transient API errors with capped backoff."""
+    delay = base
+    while True:
+        try:
+            return call()
+        except gspread.exceptions.APIError as exc:
+            tries -= 1
+            if tries <= 0 or _api_status(exc) not in statuses:
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, cap)
+
+
+def _connect_mirror():
+    """Open the mirror spreadsheet with a minimum of round-trips.
+
+    One fetch_sheet_metadata call covers the existence checks for both
+    sheets (worksheet handles are built from the cached properties, not
+    per-name probes), one values_batch_get covers the header checks plus
+    the column-A fetch that seeds the user row index, and any header
+    fixes go out as a single values_batch_update.
+    """
+    client = get_gspread_client()
+    # open_by_key is a direct fetch; open(name) is an O(N) Drive search.
+    spreadsheet_key = st.secrets.get("spreadsheet_key")
+    if spreadsheet_key:
+        spreadsheet = client.open_by_key(spreadsheet_key)
+    else:
+        spreadsheet = client.open(SPREADSHEET_NAME)
+    meta = spreadsheet.fetch_sheet_metadata()
+    existing = {
+        sheet["properties"]["title"]: gspread.Worksheet(spreadsheet, sheet["properties"])
+        for sheet in meta["sheets"]
+    }
+    missing = [title for title in ("Users", "Ledger") if title not in existing]
+    if missing:
+        # One atomic batchUpdate provisions every missing sheet, so a
+        # failure never leaves a half-created mirror.
+        body = {
+            "requests": [
+                {
+                    "addSheet": {
+                        "properties": {
+                            "title": title,
+                            "gridProperties": {"rowCount": 1000, "columnCount": 10},
+                        }
+                    }
+                }
+                for title in missing
+            ]
+        }
+        for reply in spreadsheet.batch_update(body)["replies"]:
+            properties = reply["addSheet"]["properties"]
+            existing[properties["title"]] = gspread.Worksheet(spreadsheet, properties)
+    users_ws = existing["Users"]
+    ledger_ws = existing["Ledger"]
+
+    ranges = spreadsheet.values_batch_get(["Users!A:A", "Ledger!A1:F1"])["valueRanges"]
+    users_col = ranges[0].get("values", [])
+    ledger_header = ranges[1].get("values", [])
+    header_fixes = []
+    # An empty A1 over a populated column comes back as [] for the first
+    # row, so guard the row itself before indexing into it.
+    if not users_col or not users_col[0] or users_col[0][0] != USERS_HEADERS[0]:
+        header_fixes.append({"range": "Users!A1", "values": [USERS_HEADERS]})
+    if not ledger_header or ledger_header[0] != LEDGER_HEADERS:
+        header_fixes.append({"range": "Ledger!A1", "values": [LEDGER_HEADERS]})
+    if header_fixes:
+        spreadsheet.values_batch_update({"valueInputOption": "RAW", "data": header_fixes})
+
+    user_row_index = {row[0]: i for i, row in enumerate(users_col[1:], start=2) if row}
+    return spreadsheet, users_ws, ledger_ws, user_row_index
+
+
+def _mirror_worker():
+    spreadsheet = None
+    users_ws = None
+    ledger_ws = None
+    # user_id -> sheet row, built once from column A so user upserts are a
+    # dict lookup instead of a full get_all_records scan per mirrored write.
+    user_row_index = {}
+    while True:
+        kind, payload = _mirror_queue.get()
+        try:
+            if spreadsheet is None:
+                spreadsheet, users_ws, ledger_ws, user_row_index = _retry_api(_connect_mirror)
+            if kind == "ledger_batch":
+                try:
+                    # Writes retry on 5xx only; a 429 means we are over quota,
+                    # so re-buffer and let the next flush carry the rows.
+                    _retry_api(
+                        lambda: ledger_ws.append_rows(payload, value_input_option="RAW"),
+                        statuses=(500, 503),
+                    )
+                except gspread.exceptions.APIError as exc:
+                    if _api_status(exc) != 429:
+                        raise
+                    with _mirror_buffer_lock:
+                        _ledger_buffer[:0] = payload
+            elif kind == "user_batch":
+                data = []
+                for row in payload:
+                    user_id = str(row[0])
+                    row_num = user_row_index.get(user_id)
+                    if row_num is None:
+                        # Index miss: refresh from column A only (never the
+                        # full sheet) in case rows were added externally.
+                        user_ids = _retry_api(lambda: users_ws.col_values(1))[1:]
+                        user_row_index = {uid: i for i, uid in enumerate(user_ids, start=2)}
+                        row_num = user_row_index.get(user_id)
+                    if row_num is None:
+                        row_num = len(user_row_index) + 2
+                        user_row_index[user_id] = row_num
+                    data.append({"range": _user_range(row_num), "values": [row]})
+                try:
+                    _retry_api(
+                        lambda: spreadsheet.values_batch_update(
+                            {"valueInputOption": "RAW", "data": data}
+                        ),
+                        statuses=(500, 503),
+                    )
+                except gspread.exceptions.APIError as exc:
+                    if _api_status(exc) != 429:
+                        raise
+                    with _mirror_buffer_lock:
+                        for row in payload:
+                            # Keep any newer buffered state for the same user.
+                            _user_buffer.setdefault(str(row[0]), row)
+        except Exception:
+            # The mirror is best-effort: SQLite stays authoritative and the
+            # app keeps working when Sheets is unreachable or over quota.
+            pass
+        finally:
+            _mirror_queue.task_done()
+
+
+def _mirror(kind, payload):
+    global _mirror_thread
+    if _mirror_thread is None:
+        with _db_lock:
+            if _mirror_thread is None:
+                _mirror_thread = threading.Thread(target=_mirror_worker, daemon=True)
+                _mirror_thread.start()
+    _mirror_queue.put((kind, payload))
+
+
+def _flush_mirror_buffers():
+    with _mirror_buffer_lock:
+        ledger_batch = list(_ledger_buffer)
+        del _ledger_buffer[:]
+        user_batch = list(_user_buffer.values())
+        _user_buffer.clear()
+    if ledger_batch:
+        _mirror("ledger_batch", ledger_batch)
+    if user_batch:
+        _mirror("user_batch", user_batch)
+
+
+def _mirror_flusher():
+    while True:
+        _mirror_flush_event.wait(MIRROR_FLUSH_INTERVAL)
+        _mirror_flush_event.clear()
+        _flush_mirror_buffers()
+
+
+def _ensure_mirror_flusher():
+    global _mirror_flusher_thread
+    if _mirror_flusher_thread is None:
+        with _db_lock:
+            if _mirror_flusher_thread is None:
+                _mirror_flusher_thread = threading.Thread(target=_mirror_flusher, daemon=True)
+                _mirror_flusher_thread.start()
+                atexit.register(_flush_mirror_buffers)
+
 
-    values = worksheet.get_all_values()
-    if not values:
-        worksheet.append_row(headers)
-    elif values[0] != headers:
-        worksheet.update("A1", [headers])
+def _buffer_ledger_row(row):
+    _ensure_mirror_flusher()
+    with _mirror_buffer_lock:
+        _ledger_buffer.append(row)
+        full = len(_ledger_buffer) >= MIRROR_FLUSH_BATCH
+    if full:
+        _mirror_flush_event.set()
 
-    return worksheet
+
+def _buffer_user_row(row):
+    _ensure_mirror_flusher()
+    with _mirror_buffer_lock:
+        # Last write wins: repeated updates to the same user within a
+        # flush window collapse into one mirrored range write.
+        _user_buffer[str(row[0])] = row
+
+
+def flush_writes():
+    """Push any buffered mirror writes to Sheets immediately."""
+    _flush_mirror_buffers()
+
+
+def _user_row(user_dict):
+    return [user_dict[field] for field in USER_FIELDS]
 
 
 def init_sheets():
-    spreadsheet = get_gspread_client().open(SPREADSHEET_NAME)
-    _get_or_create_worksheet(spreadsheet, "Users", USERS_HEADERS)
-    _get_or_create_worksheet(spreadsheet, "Ledger", LEDGER_HEADERS)
+    _db()
+    # Warm up the mirror thread so worksheet provisioning happens off-thread.
+    _mirror("noop", None)
+
+
+def get_user_data(user_id):
+    """Fetch a user's row as a dict, creating the user on first sight."""
+    user_id = str(user_id)
+    conn = _db()
+    row = conn.execute(
+        "SELECT user_id, balance, daily_earned, daily_pr_count, total_earned_ever, last_daily_reset, version "
+        "FROM users WHERE user_id = ?",
+        (user_id,),
+    ).fetchone()
+    if row is None:
+        row = (user_id, STARTING_BALANCE, 0, 0, 0, today_iso(), 0)
+        cursor = conn.execute("INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+        if cursor.rowcount == 0:
+            # Lost a first-sight creation race: another session inserted
+            # this user between our SELECT and INSERT. Re-read their row.
+            return get_user_data(user_id)
+        _buffer_user_row(list(row[:-1]))
+    user_dict = dict(zip(USER_FIELDS, row[:-1]))
+    # Databases created before the columns went INTEGER hold REAL values;
+    # coerce so amounts display and accumulate as whole WeCoin.
+    for field in ("balance", "daily_earned", "total_earned_ever"):
+        user_dict[field] = int(round(user_dict[field]))
+    user_dict["_version"] = row[-1]
+    return user_dict
+
+
+def update_user_data(user_dict):
+    """Write a user row back, rejecting the write if another writer got there first."""
+    cursor = _db().execute(
+        "UPDATE users SET balance = ?, daily_earned = ?, daily_pr_count = ?, "
+        "total_earned_ever = ?, last_daily_reset = ?, version = version + 1 "
+        "WHERE user_id = ? AND version = ?",
+        (
+            user_dict["balance"],
+            user_dict["daily_earned"],
+            user_dict["daily_pr_count"],
+            user_dict["total_earned_ever"],
+            user_dict["last_daily_reset"],
+            str(user_dict["user_id"]),
+            user_dict.get("_version", 0),
+        ),
+    )
+    if cursor.rowcount == 0:
+        raise ConflictError(f"Stale write for user '{user_dict['user_id']}'")
+    user_dict["_version"] = user_dict.get("_version", 0) + 1
+    _buffer_user_row(_user_row(user_dict))
+
+
+def append_ledger(user_id, action, pr_ea_id, amount, notes=""):
+    global LEDGER_VERSION
+    ts = _now_iso()
+    # WeCoin has no fractional denominations; integer amounts keep daily
+    # sums drift-free and halve the parse cost on the graph path.
+    amount = int(round(amount))
+    _db().execute(
+        "INSERT INTO ledger (ts, user_id, action, pr_ea_id, amount, notes) VALUES (?, ?, ?, ?, ?, ?)",
+        (ts, str(user_id), action, pr_ea_id, amount, notes),
+    )
+    _buffer_ledger_row([ts, str(user_id), action, pr_ea_id, amount, notes])
+    LEDGER_VERSION += 1
+
+
+def get_ledger_data():
+    """Return all ledger rows as [timestamp, user_id, action, pr_ea_id, amount, notes]."""
+    cursor = _db().execute(
+        "SELECT ts, user_id, action, pr_ea_id, amount, notes FROM ledger ORDER BY id"
+    )
+    return [list(row) for row in cursor]
+
+
+def _load_sim_state():
+    """Load simulation counters into process memory once. Callers hold _sim_lock."""
+    global _sim_state
+    if _sim_state is None:
+        row = _db().execute(
+            "SELECT hour_index, hour_awarding_so_far, current_multiplier FROM simulation WHERE id = 1"
+        ).fetchone()
+        _sim_state = {
+            "hour_index": row[0],
+            "hour_awarding_so_far": row[1],
+            "current_multiplier": row[2],
+            "_dirty": False,
+        }
+    return _sim_state
+
+
+def _flush_sim_state():
+    with _sim_lock:
+        state = _sim_state
+        if state is None or not state["_dirty"]:
+            return
+        values = (
+            state["hour_index"],
+            state["hour_awarding_so_far"],
+            state["current_multiplier"],
+        )
+        state["_dirty"] = False
+    _db().execute(
+        "UPDATE simulation SET hour_index = ?, hour_awarding_so_far = ?, current_multiplier = ? "
+        "WHERE id = 1",
+        values,
+    )
+
+
+def _sim_flusher():
+    while True:
+        time.sleep(SIM_FLUSH_INTERVAL)
+        _flush_sim_state()
+
+
+def _ensure_sim_flusher():
+    global _sim_flusher_thread
+    if _sim_flusher_thread is None:
+        with _db_lock:
+            if _sim_flusher_thread is None:
+                _sim_flusher_thread = threading.Thread(target=_sim_flusher, daemon=True)
+                _sim_flusher_thread.start()
+                atexit.register(_flush_sim_state)
+
+
+def bulk_apply(fn):
+    """Apply a vectorized transform to every user row in one pass.
+
+    For bulk pay-outs and reconciliation: fn receives a DataFrame of all
+    user rows and returns it with values adjusted. Each row is written
+    back guarded by the version snapshotted at read time, so any user
+    whose row changed during the read->transform->write window is skipped
+    rather than silently overwritten. Returns (written, conflicted) where
+    conflicted is the list of skipped user_ids; callers can re-run the
+    bulk for those. The transaction runs on its own connection so
+    statements from other threads never join (or roll back with) it.
+    """
+    import pandas as pd  # heavy import; only the bulk-admin path pays for it
+
+    _db()  # make sure the schema exists before opening a second connection
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        df = pd.read_sql_query(
+            "SELECT user_id, balance, daily_earned, daily_pr_count, "
+            "total_earned_ever, last_daily_reset, version FROM users",
+            conn,
+        )
+        versions = {str(uid): int(v) for uid, v in zip(df["user_id"], df["version"])}
+        result = fn(df.drop(columns=["version"]))
+
+        written = []
+        conflicted = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for row in result.itertuples(index=False):
+                user_id = str(row.user_id)
+                values = (
+                    row.balance,
+                    row.daily_earned,
+                    int(row.daily_pr_count),
+                    row.total_earned_ever,
+                    row.last_daily_reset,
+                    user_id,
+                    versions[user_id],
+                )
+                cursor = conn.execute(
+                    "UPDATE users SET balance = ?, daily_earned = ?, daily_pr_count = ?, "
+                    "total_earned_ever = ?, last_daily_reset = ?, version = version + 1 "
+                    "WHERE user_id = ? AND version = ?",
+                    values,
+                )
+                if cursor.rowcount == 0:
+                    conflicted.append(user_id)
+                else:
+                    written.append(values)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    for balance, daily_earned, daily_pr_count, total_ever, last_reset, user_id, _ in written:
+        _buffer_user_row([user_id, balance, daily_earned, daily_pr_count, total_ever, last_reset])
+    return len(written), conflicted
+
+
+def get_daily_award_sums(mode="global", user_id=None):
+    """Day-bucketed award totals as sorted (day, total) pairs.
+
+    The filter and aggregation run inside SQLite, so graph renders never
+    materialize the full ledger in Python.
+    """
+    query = "SELECT substr(ts, 1, 10) AS day, SUM(amount) FROM ledger"
+    params = []
+    if mode == "user" and user_id:
+        query += " WHERE user_id = ?"
+        params.append(str(user_id))
+    elif mode == "pr":
+        query += " WHERE action = 'POST_PR'"
+    elif mode == "ea":
+        query += " WHERE action = 'POST_EA'"
+    query += " GROUP BY day ORDER BY day"
+    return _db().execute(query, params).fetchall()
+
+
+def get_simulation_data():
+    with _sim_lock:
+        state = _load_sim_state()
+        return {
+            "hour_index": state["hour_index"],
+            "hour_awarding_so_far": state["hour_awarding_so_far"],
+            "current_multiplier": state["current_multiplier"],
+        }
+
+
+def add_hour_awarding(delta):
+    """Add an award to the hourly counter atomically under _sim_lock.
+
+    Awarding paths must use this rather than writing an absolute value
+    through update_simulation_data: concurrent awards each read the same
+    starting counter, so writing back read + own_award would erase every
+    increment committed in between.
+    """
+    if not delta:
+        return
+    _ensure_sim_flusher()
+    with _sim_lock:
+        state = _load_sim_state()
+        state["hour_awarding_so_far"] += delta
+        state["_dirty"] = True
+
+
+def update_simulation_data(sim_dict):
+    """Update hour_index and current_multiplier; the database is synced periodically.
+
+    The hour_awarding_so_far counter is deliberately not taken from
+    sim_dict (see add_hour_awarding); the caller's copy is stale by the
+    time it gets here.
+    """
+    _ensure_sim_flusher()
+    with _sim_lock:
+        state = _load_sim_state()
+        rollover = sim_dict["hour_index"] != state["hour_index"]
+        if (
+            not rollover
+            and sim_dict["current_multiplier"] == state["current_multiplier"]
+        ):
+            # Nothing actually changed; don't dirty the state, so bursts of
+            # identical updates cost zero flushes.
+            return
+        state["hour_index"] = sim_dict["hour_index"]
+        state["current_multiplier"] = sim_dict["current_multiplier"]
+        state["_dirty"] = True
+    if rollover:
+        _flush_sim_state()
 
 
 def register_user(user_id):
-    worksheet = get_gspread_client().open(SPREADSHEET_NAME).worksheet("Users")
-    existing_user_ids = [row[0] for row in worksheet.get_all_values()[1:] if row]
-    if user_id in existing_user_ids:
+    conn = _db()
+    exists = conn.execute("SELECT 1 FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+    if exists:
         return False
 
-    worksheet.append_row([user_id, STARTING_BALANCE])
+    get_user_data(user_id)
     return True
 
 
 def post_pr(user_id):
-    spreadsheet = get_gspread_client().open(SPREADSHEET_NAME)
-    users_ws = spreadsheet.worksheet("Users")
-    ledger_ws = spreadsheet.worksheet("Ledger")
-
-    data = users_ws.get_all_records()
-    for index, row in enumerate(data, start=2):
-        if row["user_id"] == user_id:
-            balance = float(row["balance"]) + PR_AWARD
-            users_ws.update_cell(index, 2, balance)
-            ledger_ws.append_row([datetime.now().isoformat(), user_id, "PR", PR_AWARD])
+    conn = _db()
+    exists = conn.execute("SELECT 1 FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+    if not exists:
+        return False
+
+    with user_lock(user_id):
+        for attempt in range(3):
+            user_dict = get_user_data(user_id)
+            # balance comes back from SQLite as a native number already.
+            user_dict["balance"] += PR_AWARD
+            try:
+                update_user_data(user_dict)
+            except ConflictError:
+                time.sleep(0.05 * (2 ** attempt))
+                continue
+            append_ledger(user_id, "PR", "N/A", PR_AWARD, "User posted PR")
             return True
 
+    # Conflict retries exhausted (e.g. a concurrent bulk_apply); nothing
+    # was awarded, so report failure instead of surfacing a traceback.
     return False
 
 
 def get_balance(user_id):
-    worksheet = get_gspread_client().open(SPREADSHEET_NAME).worksheet("Users")
-    data = worksheet.get_all_records()
-    for row in data:
-        if row["user_id"] == user_id:
-            return row["balance"]
-    return 0
+    row = _db().execute(
+        "SELECT balance FROM users WHERE user_id = ?", (str(user_id),)
+    ).fetchone()
+    return int(round(row[0])) if row else 0